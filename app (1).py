@@ -1,6 +1,11 @@
 import streamlit as st
+import io
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import pyarrow as pa
 from datetime import datetime
 
 # ────────────────────────────────────────────────
@@ -21,13 +26,102 @@ This dashboard analyzes historical retail sales data to uncover key trends, top-
 # ────────────────────────────────────────────────
 # 1. Data Loading with Caching
 # ────────────────────────────────────────────────
+# Columns the charts and KPIs use; filter_data() projects to these while
+# the preview and the export keep every column in train.csv
+DATA_COLUMNS = ['Order ID', 'Order Date', 'Customer Name', 'Segment',
+                'Region', 'Category', 'Sub-Category', 'Product Name', 'Sales']
+
+# Bump whenever clean_sales_csv() changes so existing train.parquet
+# copies written by an older version are rebuilt
+CACHE_VERSION = 2
+
+def clean_sales_csv() -> pd.DataFrame:
+    # Repeated strings become integer-coded categoricals so every
+    # groupby and filter works on codes rather than hashing strings
+    raw = pd.read_csv(
+        "train.csv",
+        engine="pyarrow",
+        dtype={
+            'Region': 'category',
+            'Category': 'category',
+            'Sub-Category': 'category',
+            'Segment': 'category',
+            'Product Name': 'category',
+            'Customer Name': 'category',
+            'Order Date': 'str',
+            'Postal Code': 'float64',
+        }
+    )
+    df = raw.dropna(subset=['Order Date', 'Sales'])
+    duplicates = int(df.duplicated().sum())
+    df = df.drop_duplicates()
+    deduped_shape = df.shape
+
+    # Unparseable or impossible dates (e.g. 31/02/2017) become NaT and
+    # are dropped, so Order Date is always stored as a datetime column
+    df['Order Date'] = pd.to_datetime(df['Order Date'], format='%d/%m/%Y', errors='coerce')
+    invalid_dates = int(df['Order Date'].isna().sum())
+    df = df.dropna(subset=['Order Date'])
+    # Sorting once by date lets the groupbys below skip sorting their
+    # keys and keeps the monthly/yearly groups in chronological order.
+    # The original row index is kept so user-facing output can restore
+    # file order with sort_index()
+    df = df.sort_values('Order Date', kind='stable')
+
+    # The cleaning report describes the raw file; pandas keeps df.attrs
+    # in the Parquet metadata so later launches can show it unchanged
+    df.attrs['cleaning'] = {
+        'raw_shape': list(raw.shape),
+        'columns': raw.columns.tolist(),
+        # Per-column non-null counts avoid building a full boolean frame
+        'missing': {c: int(n) for c, n in (len(raw) - raw.count()).items() if n},
+        'duplicates': duplicates,
+        'deduped_shape': list(deduped_shape),
+        'invalid_dates': invalid_dates,
+        'cleaned_shape': list(df.shape),
+    }
+    df.attrs['cache_version'] = CACHE_VERSION
+    return df
+
+def read_sales() -> pd.DataFrame:
+    # Parse and clean the CSV once into a typed Parquet copy that later
+    # launches read instead; it is rebuilt whenever train.csv is newer
+    if (os.path.exists("train.parquet") and
+            os.path.getmtime("train.parquet") >= os.path.getmtime("train.csv")):
+        # An unreadable, corrupt or outdated copy is rebuilt from the CSV
+        try:
+            df = pd.read_parquet("train.parquet", engine="pyarrow")
+            if df.attrs.get('cache_version') == CACHE_VERSION and 'cleaning' in df.attrs:
+                return df
+        except (OSError, pa.ArrowException):
+            pass
+
+    df = clean_sales_csv()
+    # Write to a temporary file and move it into place so an interrupted
+    # write never leaves a truncated train.parquet behind; on a read-only
+    # deploy the cleaned frame is simply served from memory
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=".", prefix="train.parquet.", suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp_path, compression="zstd")
+        # mkstemp creates the file as 0600; keep the copy readable by
+        # other users running the app
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, "train.parquet")
+    except OSError:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df
+
 @st.cache_data
-def load_data():
-    return pd.read_csv("train.csv")
+def load_and_clean() -> pd.DataFrame:
+    return read_sales()
 
-df = load_data()
+df = load_and_clean()
+summary = df.attrs['cleaning']
 
-st.success(f"Dataset loaded successfully — {df.shape[0]:,} rows × {df.shape[1]} columns")
+st.success(f"Dataset loaded successfully — {summary['raw_shape'][0]:,} rows × {summary['raw_shape'][1]} columns")
 
 # ────────────────────────────────────────────────
 # 2. Data Cleaning & Preprocessing
@@ -37,40 +131,33 @@ with st.expander("Data Cleaning & Preprocessing", expanded=True):
 
     with col1:
         st.subheader("Dataset Overview")
-        st.write(f"**Rows:** {df.shape[0]:,}")
-        st.write(f"**Columns:** {df.shape[1]}")
-        st.write("**Column Names:**", df.columns.tolist())
+        st.write(f"**Rows:** {summary['raw_shape'][0]:,}")
+        st.write(f"**Columns:** {summary['raw_shape'][1]}")
+        st.write("**Column Names:**", summary['columns'])
 
     with col2:
         st.subheader("Missing Values")
-        missing = df.isnull().sum()
-        if missing.sum() > 0:
-            st.write(missing[missing > 0])
-            df = df.dropna(subset=['Order Date', 'Sales'])
+        if summary['missing']:
+            st.write(pd.Series(summary['missing'], dtype='int64'))
         else:
             st.success("No missing values detected.")
 
-    # Remove duplicates
-    duplicates = df.duplicated().sum()
-    st.write(f"**Duplicate rows found:** {duplicates}")
-    if duplicates > 0:
-        df = df.drop_duplicates()
-        st.success(f"Duplicates removed. New shape: {df.shape}")
+    # Rows with missing Order Date / Sales, duplicates and invalid dates
+    # were dropped inside load_and_clean(); report what was removed
+    st.write(f"**Duplicate rows found:** {summary['duplicates']}")
+    if summary['duplicates'] > 0:
+        st.success(f"Duplicates removed. New shape: {tuple(summary['deduped_shape'])}")
 
-    # Convert date column
-    df['Order Date'] = pd.to_datetime(df['Order Date'], format='%d/%m/%Y', errors='coerce')
-    invalid_dates = df['Order Date'].isnull().sum()
-    if invalid_dates > 0:
-        st.warning(f"Dropped {invalid_dates} rows with invalid dates.")
-        df = df.dropna(subset=['Order Date'])
+    if summary['invalid_dates'] > 0:
+        st.warning(f"Dropped {summary['invalid_dates']} rows with invalid dates.")
 
-    st.write("**Cleaned Dataset Shape:**", df.shape)
-    st.dataframe(df.head(5), use_container_width=True)
+    st.write("**Cleaned Dataset Shape:**", tuple(summary['cleaned_shape']))
+    st.dataframe(df.sort_index().head(5), use_container_width=True)
 
 # ────────────────────────────────────────────────
 # Important Note: Missing Profit / Cost Columns
 # ────────────────────────────────────────────────
-if 'Profit' not in df.columns:
+if 'Profit' not in summary['columns']:
     st.warning("""
     **Note:** This dataset does not contain 'Profit', 'Cost Price' or 'Quantity' columns.  
     Therefore, profit margin analysis and loss-making products cannot be calculated.  
@@ -83,21 +170,52 @@ if 'Profit' not in df.columns:
 st.sidebar.header("Filters")
 selected_regions = st.sidebar.multiselect(
     "Region",
-    options=sorted(df['Region'].unique()),
-    default=df['Region'].unique()
+    options=sorted(df['Region'].cat.categories),
+    default=df['Region'].cat.categories
 )
 
 selected_categories = st.sidebar.multiselect(
     "Category",
-    options=sorted(df['Category'].unique()),
-    default=df['Category'].unique()
+    options=sorted(df['Category'].cat.categories),
+    default=df['Category'].cat.categories
 )
 
-# Apply filters
-filtered_df = df[
-    (df['Region'].isin(selected_regions)) &
-    (df['Category'].isin(selected_categories))
-]
+# Cache key for every aggregation below. Sorted tuples are order-independent
+# and hashed element by element by st.cache_data, whereas a frozenset falls
+# back to __reduce__ and is hashed in its (unstable) iteration order
+region_key = tuple(sorted(selected_regions))
+cat_key = tuple(sorted(selected_categories))
+
+def filter_mask(data, regions, categories):
+    # Compare the small integer category codes instead of hashing each
+    # row's region/category string
+    region_col, cat_col = data['Region'].cat, data['Category'].cat
+    sel_region_codes = region_col.categories.get_indexer(list(regions))
+    sel_cat_codes = cat_col.categories.get_indexer(list(categories))
+    return (
+        np.isin(region_col.codes.to_numpy(), sel_region_codes) &
+        np.isin(cat_col.codes.to_numpy(), sel_cat_codes)
+    )
+
+@st.cache_data
+def filter_data(region_tuple, cat_tuple):
+    data = load_and_clean()
+    return data.loc[filter_mask(data, region_tuple, cat_tuple), DATA_COLUMNS]
+
+@st.cache_data
+def kpis(region_tuple, cat_tuple):
+    totals = filter_data(region_tuple, cat_tuple).agg({
+        'Sales': 'sum',
+        'Order ID': 'nunique',
+        'Product Name': 'nunique',
+        'Customer Name': 'nunique'
+    })
+    return (
+        float(totals['Sales']),
+        int(totals['Order ID']),
+        int(totals['Product Name']),
+        int(totals['Customer Name'])
+    )
 
 # ────────────────────────────────────────────────
 # Key Performance Indicators (KPIs)
@@ -105,10 +223,109 @@ filtered_df = df[
 st.header("Key Business Metrics")
 col1, col2, col3, col4 = st.columns(4)
 
-col1.metric("Total Revenue", f"${filtered_df['Sales'].sum():,.2f}")
-col2.metric("Total Orders", filtered_df['Order ID'].nunique())
-col3.metric("Unique Products", filtered_df['Product Name'].nunique())
-col4.metric("Unique Customers", filtered_df['Customer Name'].nunique())
+total_sales, total_orders, unique_products, unique_customers = kpis(region_key, cat_key)
+col1.metric("Total Revenue", f"${total_sales:,.2f}")
+col2.metric("Total Orders", total_orders)
+col3.metric("Unique Products", unique_products)
+col4.metric("Unique Customers", unique_customers)
+
+# ────────────────────────────────────────────────
+# Cached Aggregations (keyed on the filter selection)
+# ────────────────────────────────────────────────
+MONTH_ORDER = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+def sales_by(data, keys):
+    # Single entry point for the dashboard's Sales group-sums
+    return data.groupby(keys, sort=False, observed=True)['Sales'].sum()
+
+def top_sales_pairs(data, name_col, group_col, n):
+    # Top-n (name, group) pairs by total Sales: one np.bincount pass over
+    # combined category codes plus a partial argpartition select, instead
+    # of a full hash groupby followed by nlargest
+    names = data[name_col].astype('category').cat
+    groups = data[group_col].astype('category').cat
+    n_groups = len(groups.categories)
+    valid = (names.codes.to_numpy() >= 0) & (groups.codes.to_numpy() >= 0)
+    pair_codes = (
+        names.codes.to_numpy()[valid].astype(np.int64) * n_groups +
+        groups.codes.to_numpy()[valid]
+    )
+    size = len(names.categories) * n_groups
+    totals = np.bincount(pair_codes, weights=data['Sales'].to_numpy()[valid], minlength=size)
+    observed = np.flatnonzero(np.bincount(pair_codes, minlength=size))
+
+    cutoff = max(observed.size - n, 0)
+    if observed.size:
+        top = observed[np.argpartition(totals[observed], cutoff)[cutoff:]]
+    else:
+        top = observed
+    top = top[np.argsort(-totals[top], kind='stable')]
+    return pd.DataFrame({
+        name_col: names.categories[top // n_groups],
+        group_col: groups.categories[top % n_groups],
+        'Sales': totals[top]
+    })
+
+@st.cache_data
+def get_top_products(region_tuple, cat_tuple):
+    return top_sales_pairs(filter_data(region_tuple, cat_tuple), 'Product Name', 'Category', 15)
+
+@st.cache_data
+def get_region_sales(region_tuple, cat_tuple):
+    return (
+        sales_by(filter_data(region_tuple, cat_tuple), 'Region')
+        .reset_index()
+        .sort_values('Sales', ascending=False)
+    )
+
+@st.cache_data
+def get_category_sales(region_tuple, cat_tuple):
+    return (
+        sales_by(filter_data(region_tuple, cat_tuple), 'Category')
+        .sort_index()
+        .reset_index()
+    )
+
+@st.cache_data
+def get_subcategory_sales(region_tuple, cat_tuple):
+    return (
+        sales_by(filter_data(region_tuple, cat_tuple), ['Category', 'Sub-Category'])
+        .nlargest(20)
+        .reset_index()
+    )
+
+@st.cache_data
+def get_seasonal_sales(region_tuple, cat_tuple):
+    data = filter_data(region_tuple, cat_tuple)
+    # Group on integer month/year arrays (rows arrive in date order)
+    # instead of copying the frame to attach columns; month names are
+    # attached only to the small aggregated frame
+    month = data['Order Date'].dt.month.to_numpy(dtype='int8')
+    year = data['Order Date'].dt.year.to_numpy(dtype='int16')
+
+    monthly = (
+        sales_by(data, [year, month])
+        .rename_axis(['Year', 'Month'])
+        .reset_index()
+    )
+    monthly['Month'] = pd.Categorical.from_codes(monthly['Month'] - 1, categories=MONTH_ORDER, ordered=True)
+
+    yearly = sales_by(data, year).rename_axis('Year').reset_index()
+    return monthly, yearly
+
+@st.cache_data
+def get_top_customers(region_tuple, cat_tuple):
+    return top_sales_pairs(filter_data(region_tuple, cat_tuple), 'Customer Name', 'Segment', 15)
+
+@st.cache_resource
+def make_figure(chart, data_hash, _data, **kwargs):
+    # Figures are cached on a content hash of the aggregated frame, so
+    # reruns that leave the data unchanged reuse the built Figure
+    return getattr(px, chart)(_data, **kwargs)
+
+def frame_hash(frame):
+    return int(pd.util.hash_pandas_object(frame).sum())
 
 # ────────────────────────────────────────────────
 # Main Insights Tabs
@@ -122,18 +339,13 @@ tab1, tab2, tab3, tab4, tab5 = st.tabs([
 ])
 
 # ───── Tab 1 ─────
-with tab1:
+@st.fragment
+def render_top_products(region_tuple, cat_tuple):
     st.subheader("Top Performing Products by Revenue")
-    top_products = (
-        filtered_df.groupby(['Product Name', 'Category'])['Sales']
-        .sum()
-        .reset_index()
-        .sort_values('Sales', ascending=False)
-        .head(15)
-    )
+    top_products = get_top_products(region_tuple, cat_tuple)
 
-    fig1 = px.bar(
-        top_products,
+    fig1 = make_figure(
+        'bar', frame_hash(top_products), top_products,
         x='Sales',
         y='Product Name',
         orientation='h',
@@ -142,62 +354,63 @@ with tab1:
         labels={'Sales': 'Total Sales (USD)'},
         height=550
     )
-    st.plotly_chart(fig1, use_container_width=True)
+    st.plotly_chart(fig1, use_container_width=True, key="top_products")
 
     st.dataframe(
-        top_products.style.format({'Sales': '${:,.2f}'}),
+        top_products,
+        column_config={'Sales': st.column_config.NumberColumn(format='dollar')},
         use_container_width=True
     )
 
+with tab1:
+    render_top_products(region_key, cat_key)
+
 # ───── Tab 2 ─────
-with tab2:
+@st.fragment
+def render_region_performance(region_tuple, cat_tuple):
     st.subheader("Revenue by Region")
-    region_sales = (
-        filtered_df.groupby('Region')['Sales']
-        .sum()
-        .reset_index()
-        .sort_values('Sales', ascending=False)
-    )
+    region_sales = get_region_sales(region_tuple, cat_tuple)
 
-    fig2 = px.pie(
-        region_sales,
+    fig2 = make_figure(
+        'pie', frame_hash(region_sales), region_sales,
         names='Region',
         values='Sales',
         title="Revenue Distribution by Region"
     )
-    st.plotly_chart(fig2)
+    st.plotly_chart(fig2, key="region_share")
 
-    fig2b = px.bar(
-        region_sales,
+    fig2b = make_figure(
+        'bar', frame_hash(region_sales), region_sales,
         x='Region',
         y='Sales',
         title="Total Revenue per Region",
         text_auto=True
     )
-    st.plotly_chart(fig2b, use_container_width=True)
+    st.plotly_chart(fig2b, use_container_width=True, key="region_revenue")
 
     if not region_sales.empty:
         top_region = region_sales.iloc[0]
         st.success(f"**Top Performing Region:** {top_region['Region']} — ${top_region['Sales']:,.2f}")
 
+with tab2:
+    render_region_performance(region_key, cat_key)
+
 # ───── Tab 3 ─────
-with tab3:
+@st.fragment
+def render_category_analysis(region_tuple, cat_tuple):
     st.subheader("Performance by Category & Sub-Category")
 
-    cat_sales = filtered_df.groupby('Category')['Sales'].sum().reset_index()
-    fig3 = px.pie(cat_sales, names='Category', values='Sales', title="Sales Share by Category")
-    st.plotly_chart(fig3)
-
-    subcat_sales = (
-        filtered_df.groupby(['Category', 'Sub-Category'])['Sales']
-        .sum()
-        .reset_index()
-        .sort_values('Sales', ascending=False)
-        .head(20)
+    cat_sales = get_category_sales(region_tuple, cat_tuple)
+    fig3 = make_figure(
+        'pie', frame_hash(cat_sales), cat_sales,
+        names='Category', values='Sales', title="Sales Share by Category"
     )
+    st.plotly_chart(fig3, key="category_share")
+
+    subcat_sales = get_subcategory_sales(region_tuple, cat_tuple)
 
-    fig3b = px.bar(
-        subcat_sales,
+    fig3b = make_figure(
+        'bar', frame_hash(subcat_sales), subcat_sales,
         x='Sales',
         y='Sub-Category',
         color='Category',
@@ -205,56 +418,46 @@ with tab3:
         title="Top 20 Sub-Categories by Revenue",
         height=650
     )
-    st.plotly_chart(fig3b, use_container_width=True)
+    st.plotly_chart(fig3b, use_container_width=True, key="subcategory_revenue")
+
+with tab3:
+    render_category_analysis(region_key, cat_key)
 
 # ───── Tab 4 ─────
-with tab4:
+@st.fragment
+def render_seasonal_trends(region_tuple, cat_tuple):
     st.subheader("Seasonal & Yearly Sales Trends")
 
-    df_season = filtered_df.copy()
-    df_season['Month'] = df_season['Order Date'].dt.strftime('%B')
-    df_season['Year'] = df_season['Order Date'].dt.year
-
-    monthly = (
-        df_season.groupby(['Year', 'Month'])['Sales']
-        .sum()
-        .reset_index()
-    )
-
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                   'July', 'August', 'September', 'October', 'November', 'December']
-
-    monthly['Month'] = pd.Categorical(monthly['Month'], categories=month_order, ordered=True)
-    monthly = monthly.sort_values(['Year', 'Month'])
+    monthly, yearly = get_seasonal_sales(region_tuple, cat_tuple)
 
-    fig4 = px.line(
-        monthly,
+    fig4 = make_figure(
+        'line', frame_hash(monthly), monthly,
         x='Month',
         y='Sales',
         color='Year',
         markers=True,
         title="Monthly Sales Trend Across Years"
     )
-    st.plotly_chart(fig4, use_container_width=True)
+    st.plotly_chart(fig4, use_container_width=True, key="monthly_trend")
 
-    yearly = df_season.groupby('Year')['Sales'].sum().reset_index()
-    fig4b = px.bar(yearly, x='Year', y='Sales', title="Annual Revenue Trend")
-    st.plotly_chart(fig4b)
+    fig4b = make_figure(
+        'bar', frame_hash(yearly), yearly,
+        x='Year', y='Sales', title="Annual Revenue Trend"
+    )
+    st.plotly_chart(fig4b, key="annual_trend")
+
+with tab4:
+    render_seasonal_trends(region_key, cat_key)
 
 # ───── Tab 5 ─────
-with tab5:
+@st.fragment
+def render_customer_insights(region_tuple, cat_tuple):
     st.subheader("Top Customers by Revenue")
 
-    top_customers = (
-        filtered_df.groupby(['Customer Name', 'Segment'])['Sales']
-        .sum()
-        .reset_index()
-        .sort_values('Sales', ascending=False)
-        .head(15)
-    )
+    top_customers = get_top_customers(region_tuple, cat_tuple)
 
-    fig5 = px.bar(
-        top_customers,
+    fig5 = make_figure(
+        'bar', frame_hash(top_customers), top_customers,
         x='Sales',
         y='Customer Name',
         color='Segment',
@@ -262,19 +465,38 @@ with tab5:
         title="Top 15 Customers by Total Revenue",
         height=550
     )
-    st.plotly_chart(fig5, use_container_width=True)
+    st.plotly_chart(fig5, use_container_width=True, key="top_customers")
+
+with tab5:
+    render_customer_insights(region_key, cat_key)
 
 # ────────────────────────────────────────────────
 # Download Section
 # ────────────────────────────────────────────────
 st.header("Export Data")
-csv = filtered_df.to_csv(index=False).encode('utf-8')
 
-st.download_button(
-    label="Download Filtered Dataset (CSV)",
-    data=csv,
-    file_name="filtered_sales_data.csv",
-    mime="text/csv"
-)
+@st.cache_data
+def to_csv_bytes(region_tuple, cat_tuple):
+    # Writing into a binary buffer encodes as it goes, avoiding the full
+    # intermediate str that to_csv(...).encode() builds
+    buf = io.BytesIO()
+    data = load_and_clean()
+    data.iloc[filter_mask(data, region_tuple, cat_tuple)].sort_index().to_csv(buf, index=False, encoding='utf-8')
+    return buf.getvalue()
+
+# The export runs as its own fragment so clicking the download button
+# does not rerun the charts
+@st.fragment
+def render_export(region_tuple, cat_tuple):
+    csv = to_csv_bytes(region_tuple, cat_tuple)
+
+    st.download_button(
+        label="Download Filtered Dataset (CSV)",
+        data=csv,
+        file_name="filtered_sales_data.csv",
+        mime="text/csv"
+    )
+
+render_export(region_key, cat_key)
 
 st.caption("Retail Sales Analytics Dashboard • Built for professional reporting & insights")